@@ -1,34 +1,210 @@
 import os
-import io
-import sys
 import asyncio
+import atexit
+import functools
+import importlib.util
+import queue
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import re # Import the re module for regular expressions
+from cachetools import TTLCache
+from html import escape
+import numpy as np
+import google.generativeai as genai
+from google.api_core.exceptions import ResourceExhausted, ServerError, TooManyRequests
+from tenacity import (AsyncRetrying, retry, retry_if_exception, retry_if_exception_type, stop_after_attempt,
+                      wait_random_exponential)
 from fastapi import FastAPI, Form
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, Response, StreamingResponse
 from dotenv import load_dotenv
+from pydantic import PositiveInt
+from pydantic_settings import BaseSettings, SettingsConfigDict
 
 # Import PHI components
 import phi
 from phi.agent import Agent
-from phi.model.openai import OpenAIChat # Although not used, keeping as it was in original
-from phi.model.groq import Groq # Although not used, keeping as it was in original
 from phi.model.google import Gemini
 from phi.tools.duckduckgo import DuckDuckGo
 from phi.tools.yfinance import YFinanceTools
 
-# Load environment variables from .env file
-# Removed duplicate load_dotenv() and os.environ assignments
+# Load environment variables from .env file (searched upward from this module). This goes into
+# os.environ so that settings phi reads itself (PHI_MONITORING, PHI_TELEMETRY, PHI_DEBUG, ...)
+# still take effect.
 load_dotenv()
-os.environ["GROQ_API_KEY"] = os.getenv("GROQ_API_KEY") # Keep if you plan to use Groq models
-phi.api = os.getenv("PHI_API_KEY")
-os.environ["GOOGLE_API_KEY"] = os.getenv("GOOGLE_API_KEY")
+
+# Configuration, read once from the environment into a frozen object.
+# GOOGLE_API_KEY is required and the sizes must be positive, so a missing key or a zero
+# concurrency fails here with a clear validation error.
+class Settings(BaseSettings):
+    model_config = SettingsConfigDict(extra="ignore", frozen=True)
+
+    google_api_key: str
+    phi_api_key: str | None = None
+    # Per worker process: permits, agent pools and caches are not shared between workers, so
+    # the total number of Gemini calls in flight is WORKERS x GEMINI_MAX_CONCURRENCY
+    gemini_max_concurrency: PositiveInt = 8
+    # Production worker processes. One by default, so the concurrency bound above holds as is.
+    workers: PositiveInt = 1
+    # Exposes /debug/cache. App-specific, since a generic DEBUG is often set for other tools (DEBUG=app:*)
+    cache_debug: bool = False
+
+settings = Settings()
+
+# Export the keys for libraries that read them from the environment (phi, google-generativeai)
+if settings.phi_api_key is not None:
+    os.environ["PHI_API_KEY"] = settings.phi_api_key
+phi.api = settings.phi_api_key
+os.environ["GOOGLE_API_KEY"] = settings.google_api_key
+
+# This regex matches ANSI CSI escape codes (7-bit ESC [ or 8-bit CSI introducer), compiled once
+# and reused on every call. Parameter, intermediate and final bytes are disjoint ASCII ranges,
+# so a match can never backtrack between them.
+_ANSI_RE = re.compile(r'(?:\x1B\[|\x9B)[\x30-\x3F]*[\x20-\x2F]*[\x40-\x7E]', re.ASCII)
+# Longest text whose stripped form is memoized
+ANSI_CACHE_MAX_LENGTH = 64_000
+
+# Exact-match response cache (normalized prompt -> response), evicted least-recently-used first.
+# Entries expire after a minute, like the YFinance results underneath, so answers about
+# current prices never outlive the data they were built from.
+RESPONSE_CACHE_SIZE = 512
+RESPONSE_CACHE_TTL = 60
+_response_cache = TTLCache(maxsize=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL)
+
+# Dedicated pool for blocking agent calls, sized from the same LLM concurrency setting as the
+# agent pools so it never caps throughput below GEMINI_MAX_CONCURRENCY
+EXECUTOR = ThreadPoolExecutor(max_workers=2 * settings.gemini_max_concurrency, thread_name_prefix="agent")
+atexit.register(EXECUTOR.shutdown)
+
+# Semantic cache tier: unit-length prompt embeddings stored row-wise in one float32 matrix,
+# so a lookup is a single matrix-vector product. Rows point back into the exact-match cache.
+EMBEDDING_MODEL = "models/text-embedding-004"
+SEMANTIC_CACHE_THRESHOLD = 0.92
+EMBEDDING_TIMEOUT = 5.0
+_semantic_matrix = None
+_semantic_keys = []
+_semantic_next_row = 0
+
+# Common company names, as they are written when meant as the company, and the tickers they
+# trade under. Used to split multi-company queries into per-ticker sub-queries before any agent
+# is invoked. Matching is case-sensitive so everyday words ("apple and oranges", "meta
+# analysis", "uber-rich") are not mistaken for companies.
+_COMPANY_TICKERS = {
+    "Tesla": "TSLA",
+    "NVIDIA": "NVDA",
+    "Nvidia": "NVDA",
+    "Apple": "AAPL",
+    "Microsoft": "MSFT",
+    "Amazon": "AMZN",
+    "Alphabet": "GOOGL",
+    "Google": "GOOGL",
+    "Meta": "META",
+    "Facebook": "META",
+    "Netflix": "NFLX",
+    "AMD": "AMD",
+    "Intel": "INTC",
+    "IBM": "IBM",
+    "Oracle": "ORCL",
+    "Salesforce": "CRM",
+    "Adobe": "ADBE",
+    "Broadcom": "AVGO",
+    "Qualcomm": "QCOM",
+    "PayPal": "PYPL",
+    "Uber": "UBER",
+    "Airbnb": "ABNB",
+    "Palantir": "PLTR",
+    "Walmart": "WMT",
+    "Disney": "DIS",
+    "Coca-Cola": "KO",
+    "PepsiCo": "PEP",
+    "Boeing": "BA",
+    "JPMorgan": "JPM",
+    "Goldman Sachs": "GS",
+    "Berkshire Hathaway": "BRK-B",
+}
+_KNOWN_TICKERS = frozenset(_COMPANY_TICKERS.values())
+_COMPANY_RE = re.compile(r'\b(' + '|'.join(map(re.escape, _COMPANY_TICKERS)) + r')\b')
+# Explicit tickers. Bare all-caps words are only trusted when they are known tickers: plenty of
+# ordinary finance terms are all-caps too (REIT, IRA, FOMC, NASDAQ). Other symbols count when
+# written as cashtags in any case ("$pltr") or in a ticker context ("ticker PLTR", "SNOW stock").
+_TICKER_RE = re.compile(r'\b[A-Z]{1,5}(?:-[A-Z])?\b')
+_CASHTAG_RE = re.compile(r'\$([A-Za-z]{1,5}(?:-[A-Za-z])?)\b')
+# Context symbols need at least two letters: single letters are mostly articles ("A stock split").
+_TICKER_CONTEXT_RE = re.compile(
+    r'\b(?i:ticker|symbol)[\s:]+([A-Z]{2,5}(?:-[A-Z])?)\b'
+    r'|\b([A-Z]{2,5}(?:-[A-Z])?)\s+(?i:stock|shares|share price)\b'
+)
+# All-caps words that show up in financial questions but are not meant as tickers, including
+# kinds of stock and asset classes that read like symbols in front of "stock" or "shares"
+_NON_TICKER_WORDS = frozenset({
+    "AI", "API", "ATH", "CEO", "CFO", "COO", "CPI", "CTO", "ESG", "ETF", "EU", "EUR", "EV", "EPS",
+    "FAQ", "FED", "GDP", "IPO", "IT", "NYSE", "OK", "PE", "PM", "AM", "QOQ", "ROE", "ROI", "SEC",
+    "UK", "US", "USA", "USD", "VS", "YOY", "YTD", "BUY", "SELL", "HOLD",
+    "ADR", "ADRS", "BANK", "BDC", "BLUE", "BOND", "BONDS", "CASH", "CHIP", "ETFS", "ETN", "ETNS",
+    "FAANG", "GOLD", "MAANG", "MEME", "MLP", "OIL", "OTC", "PENNY", "REIT", "REITS", "SPAC",
+    "SPACS", "TECH", "VALUE",
+})
+# Capitalised and all-caps words (two letters or more) that may name a company or symbol
+_MENTION_RE = re.compile(r'\b[A-Z][A-Za-z]+(?:-[A-Za-z]+)*\b')
+# Capitalised words that commonly start or fill a question without naming a company
+_NON_COMPANY_WORDS = frozenset({
+    "WHAT", "WHICH", "WHO", "WHY", "WHEN", "WHERE", "HOW", "IS", "ARE", "WAS", "WERE", "DO", "DOES",
+    "DID", "CAN", "COULD", "SHOULD", "WOULD", "WILL", "PLEASE", "COMPARE", "ANALYZE", "ANALYSE",
+    "SHOW", "GIVE", "GET", "TELL", "FIND", "LIST", "SUMMARIZE", "SUMMARISE", "EXPLAIN", "DESCRIBE",
+    "CHECK", "FETCH", "LOOK", "THE", "AN", "AND", "OR", "BUT", "ALSO", "HI", "HEY", "ME", "MY", "WE",
+    "JANUARY", "FEBRUARY", "MARCH", "APRIL", "MAY", "JUNE", "JULY", "AUGUST", "SEPTEMBER",
+    "OCTOBER", "NOVEMBER", "DECEMBER", "MONDAY", "TUESDAY", "WEDNESDAY", "THURSDAY", "FRIDAY",
+})
+
+# Errors worth retrying with backoff: rate limiting (429) and server-side failures (5xx).
+# One policy, shared by run_agent and stream_agent: jittered exponential backoff, up to 30 seconds.
+RETRYABLE_LLM_ERRORS = (TooManyRequests, ResourceExhausted, ServerError)
+LLM_MAX_ATTEMPTS = 4
+LLM_RETRY_WAIT = wait_random_exponential(multiplier=1, max=30)
+LLM_RETRY_STOP = stop_after_attempt(LLM_MAX_ATTEMPTS)
+
+# Upper bound on Gemini-backed agent runs in flight at once, across all requests of this worker
+# process, so bursts of traffic queue here instead of tripping the provider's rate limits. Set with GEMINI_MAX_CONCURRENCY.
+LLM_SEMAPHORE = asyncio.Semaphore(settings.gemini_max_concurrency)
+
+# Short-lived cache of YFinance tool results keyed by (tool, ticker, other arguments), shared by
+# every agent copy, so the same quote/fundamentals/news lookup within a minute (across sub-queries
+# or requests) costs one Yahoo round-trip instead of one per call
+YFINANCE_CACHE_TTL = 60
+_yfinance_cache = TTLCache(maxsize=1024, ttl=YFINANCE_CACHE_TTL)
+_yfinance_cache_lock = threading.Lock()
+
+# Wrap a YFinance tool function with the cache; error strings are not cached. functools.wraps
+# keeps the name, docstring and signature phi uses to describe the tool to the model.
+def cached_yfinance_tool(function):
+    @functools.wraps(function)
+    def wrapper(**kwargs):
+        if isinstance(kwargs.get("symbol"), str):
+            kwargs["symbol"] = kwargs["symbol"].strip().upper()
+        key = (function.__name__, tuple(sorted(kwargs.items())))
+        with _yfinance_cache_lock:
+            result = _yfinance_cache.get(key)
+        if result is None:
+            result = function(**kwargs)
+            if isinstance(result, str) and not result.startswith(("Error", "Could not")):
+                with _yfinance_cache_lock:
+                    _yfinance_cache[key] = result
+        return result
+    return wrapper
+
+# YFinanceTools whose registered tool functions go through the shared result cache
+class CachedYFinanceTools(YFinanceTools):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        for function in self.functions.values():
+            function.entrypoint = cached_yfinance_tool(function.entrypoint)
 
 
 ## Web search agent
 web_search_agent = Agent(
     name="Web Search Agent",
     role="Search the web for the information",
-    model=Gemini(id="gemini-2.0-flash"),
+    model=Gemini(id="gemini-2.0-flash", api_key=settings.google_api_key),
     tools=[DuckDuckGo()],
     instructions=["Always include sources"],
     show_tools_calls=True,
@@ -40,10 +216,10 @@ finance_agent = Agent(
     name="Finance AI Agent",
     # Added a more descriptive role for better orchestration
     role="Provides current stock prices, analyst recommendations, company fundamentals, and news for a given stock ticker symbol.",
-    model=Gemini(id="gemini-2.0-flash"),
+    model=Gemini(id="gemini-2.0-flash", api_key=settings.google_api_key),
     tools=[
-        YFinanceTools(stock_price=True, analyst_recommendations=True, stock_fundamentals=True,
-                      company_news=True),
+        CachedYFinanceTools(stock_price=True, analyst_recommendations=True, stock_fundamentals=True,
+                            company_news=True),
     ],
     instructions=[
         "Use tables to display the data.",
@@ -57,7 +233,7 @@ finance_agent = Agent(
 multi_ai_agent = Agent(
     name="Multi AI Agent",
     role="Uses multiple AI models to answer questions by orchestrating other agents. It will process financial queries by explicitly extracting stock ticker symbols and passing them to the Finance AI Agent.",
-    model=Gemini(id="gemini-2.0-flash"),
+    model=Gemini(id="gemini-2.0-flash", api_key=settings.google_api_key),
     team=[web_search_agent, finance_agent],
     instructions=[
         "Always include sources when providing information from searches.",
@@ -75,33 +251,246 @@ multi_ai_agent = Agent(
 
 # Function to strip ANSI escape codes
 def strip_ansi_codes(text):
-    # This regex matches common ANSI escape codes
-    ansi_escape = re.compile(r'\x1B\[[0-?]*[ -/]*[@-~]')
-    return ansi_escape.sub('', text)
-
-# Helper function to capture printed output from the agent and strip ANSI codes.
-def get_agent_response(prompt: str) -> str:
-    capture = io.StringIO()
-    old_stdout = sys.stdout
-    sys.stdout = capture
+    # Fast path: plain text has no ESC (or 8-bit CSI) byte, so skip the regex pass entirely.
+    # This scan is cheaper than hashing the text for a cache lookup, so it comes first.
+    if '\x1b' not in text and '\x9b' not in text:
+        return text
+    # Large buffers bypass the memo so it never pins megabytes of text
+    if len(text) > ANSI_CACHE_MAX_LENGTH:
+        return _ANSI_RE.sub('', text)
+    return _strip_ansi_codes_cached(text)
+
+# Stripping is deterministic, so identical colored outputs reuse the earlier result
+@functools.lru_cache(maxsize=256)
+def _strip_ansi_codes_cached(text):
+    return _ANSI_RE.sub('', text)
+
+# Ticker matches in a query as (start, end, ticker), in no particular order
+def find_ticker_matches(query: str) -> list[tuple[int, int, str]]:
+    matches = []
+    for match in _COMPANY_RE.finditer(query):
+        matches.append((*match.span(), _COMPANY_TICKERS[match.group(1)]))
+    for match in _TICKER_RE.finditer(query):
+        if match.group(0) in _KNOWN_TICKERS:
+            matches.append((*match.span(), match.group(0)))
+    # In an all-caps query every word looks like a symbol, so only trust known ones and cashtags there
+    if not query.isupper():
+        for match in _TICKER_CONTEXT_RE.finditer(query):
+            symbol = match.group(match.lastindex)
+            if symbol not in _NON_TICKER_WORDS:
+                matches.append((*match.span(match.lastindex), symbol))
+    for match in _CASHTAG_RE.finditer(query):
+        matches.append((*match.span(), match.group(1).upper()))
+    return matches
+
+# Extract the tickers a query refers to, in order of first mention and without duplicates
+def extract_tickers(query: str) -> list[str]:
+    return list(dict.fromkeys(ticker for _, _, ticker in sorted(find_ticker_matches(query))))
+
+# Tickers to fan a query out to, or an empty list when the orchestrator should answer it whole.
+# A fanned-out query is only answered for the tickers found, so this requires every company or
+# symbol-like word in it to have resolved: "Tesla vs Ford" and "Compare TSLA and RIVN" go to the
+# orchestrator instead of silently dropping the company that was not recognised.
+def route_tickers(query: str) -> list[str]:
+    matches = find_ticker_matches(query)
+    for mention in _MENTION_RE.finditer(query):
+        word = mention.group(0).upper()
+        if word in _NON_COMPANY_WORDS or word in _NON_TICKER_WORDS:
+            continue
+        if not any(start <= mention.start() and mention.end() <= end for start, end, _ in matches):
+            return []
+    return list(dict.fromkeys(ticker for _, _, ticker in sorted(matches)))
+
+# Pools of ready-to-run agent copies. A phi Agent keeps per-run state on the instance, so
+# concurrent runs each need their own copy; building them once up front means each copy keeps
+# its Gemini client and registered tool functions across requests instead of redoing that setup.
+def build_agent_pool(agent: Agent, size: int) -> queue.SimpleQueue:
+    pool = queue.SimpleQueue()
+    for _ in range(size):
+        pool.put(agent.deep_copy())
+    return pool
+
+_finance_agent_pool = build_agent_pool(finance_agent, settings.gemini_max_concurrency)
+_multi_agent_pool = build_agent_pool(multi_ai_agent, settings.gemini_max_concurrency)
+
+# Return a pooled agent after a run, dropping the run's history so pooled agents
+# neither grow nor leak context between requests
+def release_agent(pool: queue.SimpleQueue, agent: Agent) -> None:
+    for member in [agent, *(agent.team or [])]:
+        member.memory.clear()
+    pool.put(agent)
+
+# Run a pooled agent (blocking; called on the executor)
+def run_pooled_agent(pool: queue.SimpleQueue, prompt: str) -> str:
+    agent = pool.get()
+    try:
+        # run() returns the uncolored response content, so there is no rich output to capture and clean up
+        response = agent.run(prompt)
+    finally:
+        release_agent(pool, agent)
+    # Guard against stray escape codes coming back from tools; plain text takes the fast path
+    return strip_ansi_codes(response.content or "")
+
+# Stream a pooled agent's response (blocking; called on the executor). Chunks are handed to
+# the event loop through `chunks`, followed by None once the run is over.
+def stream_pooled_agent(pool: queue.SimpleQueue, prompt: str, loop: asyncio.AbstractEventLoop, chunks: asyncio.Queue) -> None:
+    agent = pool.get()
+    try:
+        for response in agent.run(prompt, stream=True):
+            if response.content:
+                loop.call_soon_threadsafe(chunks.put_nowait, strip_ansi_codes(response.content))
+    finally:
+        release_agent(pool, agent)
+        loop.call_soon_threadsafe(chunks.put_nowait, None)
+
+# Run the finance agent for a single ticker
+def run_finance_agent(prompt: str) -> str:
+    return run_pooled_agent(_finance_agent_pool, prompt)
+
+# Take an LLM permit and start a blocking agent run on the executor. The permit is returned
+# when the run itself finishes, not when the awaiting coroutine goes away: a cancelled request
+# or disconnected client leaves the thread (and its pooled agent) busy until Gemini answers,
+# and that run must keep counting against the bound.
+async def start_agent_run(function, *args) -> asyncio.Future:
+    loop = asyncio.get_running_loop()
+    await LLM_SEMAPHORE.acquire()
+    try:
+        run = loop.run_in_executor(EXECUTOR, function, *args)
+    except BaseException:
+        LLM_SEMAPHORE.release()
+        raise
+    run.add_done_callback(lambda _: LLM_SEMAPHORE.release())
+    return run
+
+# Await a blocking agent run on the executor. phi's Gemini model has no async implementation
+# (arun() raises NotImplementedError), so this is the only way to keep the event loop free.
+# Rate-limit (429) and server (5xx) errors are retried with jittered exponential backoff;
+# the semaphore is released while backing off so waiting retries don't block other requests.
+@retry(
+    retry=retry_if_exception_type(RETRYABLE_LLM_ERRORS),
+    wait=LLM_RETRY_WAIT,
+    stop=LLM_RETRY_STOP,
+    reraise=True,
+)
+async def run_agent(run, prompt: str) -> str:
+    # Shielded so cancelling the caller doesn't mark the run done (and free its permit) early
+    return await asyncio.shield(await start_agent_run(run, prompt))
+
+# Stream a pooled agent's response chunks as they are generated. Same retry policy as
+# run_agent, except that a run is only retried if it failed before producing any output.
+async def stream_agent(pool: queue.SimpleQueue, prompt: str):
+    loop = asyncio.get_running_loop()
+    streamed = False
+    async for attempt in AsyncRetrying(
+        retry=retry_if_exception_type(RETRYABLE_LLM_ERRORS) & retry_if_exception(lambda _: not streamed),
+        wait=LLM_RETRY_WAIT,
+        stop=LLM_RETRY_STOP,
+        reraise=True,
+    ):
+        with attempt:
+            chunks = asyncio.Queue()
+            run = await start_agent_run(stream_pooled_agent, pool, prompt, loop, chunks)
+            while (chunk := await chunks.get()) is not None:
+                streamed = True
+                yield chunk
+            # Surface any error raised by the run
+            await asyncio.shield(run)
+
+# Answer the user's query for one ticker
+async def get_ticker_response(query: str, ticker: str) -> str:
+    prompt = f"{query}\n\nAnswer only for the stock ticker symbol {ticker}."
+    return await run_agent(run_finance_agent, prompt)
+
+# Format one ticker's answer as a section of the combined response
+def format_ticker_response(ticker: str, response: str) -> str:
+    return f"## {ticker}\n\n{response.strip()}"
+
+# Stream the agent's response text as it becomes available.
+async def stream_agent_response(prompt: str):
+    tickers = route_tickers(prompt)
+    if not tickers:
+        async for chunk in stream_agent(_multi_agent_pool, prompt):
+            yield chunk
+        return
+
+    # Known companies are fanned out to the finance agent concurrently instead of letting the
+    # orchestrator walk through them one at a time; sections are sent in order as they finish.
+    # Combining them needs no extra LLM call.
+    tasks = [asyncio.ensure_future(get_ticker_response(prompt, ticker)) for ticker in tickers]
     try:
-        # This method prints the response to stdout.
-        multi_ai_agent.print_response(prompt)
+        for index, (ticker, task) in enumerate(zip(tickers, tasks)):
+            yield ("\n\n" if index else "") + format_ticker_response(ticker, await task)
     finally:
-        sys.stdout = old_stdout
-    
-    raw_output = capture.getvalue()
-    # Strip ANSI escape codes before returning the value for HTML display
-    clean_output = strip_ansi_codes(raw_output)
-    return clean_output
+        for task in tasks:
+            task.cancel()
+
+# Normalize a prompt so trivially different spellings of the same query share a cache entry
+def normalize_prompt(prompt: str) -> str:
+    return " ".join(prompt.split()).lower()
+
+# Cache key for a query: the normalized text plus the tickers it routes to. Routing is
+# case-sensitive ("NOW stock" vs "now stock") while the text is lowercased, so the tickers
+# keep queries that go to different agents from sharing an entry.
+def response_cache_key(query: str) -> tuple[str, frozenset[str]]:
+    return normalize_prompt(query), frozenset(route_tickers(query))
+
+# Look up a cached response; only ever called from the event loop, so no lock is needed
+def get_cached_response(key: tuple[str, frozenset[str]]):
+    return _response_cache.get(key)
+
+# Store a response; TTLCache drops expired entries and then the least recently used one
+def cache_response(key: tuple[str, frozenset[str]], result: str) -> None:
+    _response_cache[key] = result
+
+# Embed a prompt with the Gemini embedding API; returns a unit-length float32 vector
+async def embed_prompt(prompt: str) -> np.ndarray:
+    # Bounded so a slow embedding call can never cost more than it could save
+    result = await asyncio.wait_for(
+        genai.embed_content_async(model=EMBEDDING_MODEL, content=prompt, task_type="semantic_similarity"),
+        timeout=EMBEDDING_TIMEOUT,
+    )
+    vector = np.asarray(result["embedding"], dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+# Return the cached response of the most similar earlier prompt, if it is similar enough and
+# asks about the same tickers. Queries that differ only in the company ("Tesla stock price" vs
+# "NVIDIA stock price") embed very closely, so similarity alone would serve another company's data.
+def find_similar_response(vector: np.ndarray, tickers: frozenset[str]):
+    if not _semantic_keys:
+        return None
+    similarities = _semantic_matrix[:len(_semantic_keys)] @ vector
+    for row in np.argsort(similarities)[::-1]:
+        if similarities[row] < SEMANTIC_CACHE_THRESHOLD:
+            break
+        # Keys carry the tickers the prompt routed to. Rows whose response has expired from
+        # the cache are skipped, so a less similar but still cached answer can be used.
+        if _semantic_keys[row][1] == tickers:
+            result = get_cached_response(_semantic_keys[row])
+            if result is not None:
+                return result
+    return None
+
+# Add a prompt embedding to the semantic index, overwriting the oldest row once it is full
+def index_response(key: tuple[str, frozenset[str]], vector: np.ndarray) -> None:
+    global _semantic_matrix, _semantic_next_row
+    if _semantic_matrix is None:
+        _semantic_matrix = np.zeros((RESPONSE_CACHE_SIZE, vector.shape[0]), dtype=np.float32)
+    row = _semantic_next_row
+    _semantic_matrix[row] = vector
+    if row < len(_semantic_keys):
+        _semantic_keys[row] = key
+    else:
+        _semantic_keys.append(key)
+    _semantic_next_row = (row + 1) % RESPONSE_CACHE_SIZE
 
 # Create FastAPI app instance
 app = FastAPI()
 
-# Home route returns a simple HTML form for user input
-@app.get("/", response_class=HTMLResponse)
-async def home():
-    html_content = """
+HTML_MEDIA_TYPE = "text/html; charset=utf-8"
+
+# Static home page, built and UTF-8 encoded once at import time; the response object is
+# reused for every request
+_HOME_BYTES = """
     <!DOCTYPE html>
     <html>
     <head>
@@ -129,47 +518,115 @@ async def home():
         <!-- The result div will be populated dynamically if navigated directly to /search -->
     </body>
     </html>
-    """
-    return HTMLResponse(content=html_content)
+    """.encode("utf-8")
+HOME_RESPONSE = Response(content=_HOME_BYTES, media_type=HTML_MEDIA_TYPE)
 
-# Search route: handles form submission and returns the captured agent response
-@app.post("/search", response_class=HTMLResponse)
-async def search(query: str = Form(...)):
-    loop = asyncio.get_running_loop()
-    try:
-        # Run the blocking get_agent_response function in an executor.
-        result = await loop.run_in_executor(None, get_agent_response, query)
-        if not result.strip():
-            result = "No response received from the agent."
-    except Exception as e:
-        result = f"An error occurred: {e}"
-    
-    html_content = f"""
+# Home route returns a simple HTML form for user input
+@app.get("/", response_class=HTMLResponse)
+async def home():
+    return HOME_RESPONSE
+
+# Results page template, split around the result and pre-encoded, so only the agent output is
+# spliced in (and encoded) per request
+_SEARCH_HEAD = """
     <!DOCTYPE html>
     <html>
     <head>
         <title>Search Results</title>
         <style>
-            body {{ font-family: Arial, sans-serif; margin: 40px; background-color: #f4f7f6; color: #333; }}
-            h1 {{ color: #2c3e50; text-align: center; margin-bottom: 30px; }}
-            .result {{ margin-top: 30px; padding: 25px; border: 1px solid #e0e0e0; border-radius: 10px; background-color: #ffffff; box-shadow: 0 4px 8px rgba(0,0,0,0.05); white-space: pre-wrap; font-family: 'Courier New', Courier, monospace; font-size: 14px; line-height: 1.6; }}
-            a {{ display: block; text-align: center; margin-top: 20px; color: #007bff; text-decoration: none; transition: color 0.3s ease; }}
-            a:hover {{ color: #0056b3; }}
+            body { font-family: Arial, sans-serif; margin: 40px; background-color: #f4f7f6; color: #333; }
+            h1 { color: #2c3e50; text-align: center; margin-bottom: 30px; }
+            .result { margin-top: 30px; padding: 25px; border: 1px solid #e0e0e0; border-radius: 10px; background-color: #ffffff; box-shadow: 0 4px 8px rgba(0,0,0,0.05); white-space: pre-wrap; font-family: 'Courier New', Courier, monospace; font-size: 14px; line-height: 1.6; }
+            a { display: block; text-align: center; margin-top: 20px; color: #007bff; text-decoration: none; transition: color 0.3s ease; }
+            a:hover { color: #0056b3; }
         </style>
     </head>
     <body>
         <h1>Search Results</h1>
-        <div class="result">{result}</div>
+        <div class="result">""".encode("utf-8")
+_SEARCH_TAIL = """</div>
         <br>
         <a href="/">&#8592; Back to Search</a>
     </body>
     </html>
-    """
-    return HTMLResponse(content=html_content)
+    """.encode("utf-8")
 
-# Standard entry point for Uvicorn
-if __name__ == "__main__":
+# Stream the results page: the page head goes out immediately, then the (escaped) response
+# as it is generated, then the tail
+async def stream_search_page(query: str):
+    yield _SEARCH_HEAD
+    cache_key = response_cache_key(query)
+    prompt_text, tickers = cache_key
+    # Repeat queries are answered straight from the cache without invoking any agent
+    result = get_cached_response(cache_key)
+    vector = None
+    if result is None:
+        # Near-duplicate queries (e.g. "Tesla stock price" vs "TSLA current price") hit the semantic tier
+        try:
+            vector = await embed_prompt(prompt_text)
+            result = find_similar_response(vector, tickers)
+        except Exception:
+            # Embedding failures only disable the semantic tier for this request
+            vector = None
+    if result is None:
+        chunks = []
+        try:
+            async for chunk in stream_agent_response(query):
+                chunks.append(chunk)
+                # Agent output is text, not markup: escape it so '<', '>' and '&' display literally
+                yield escape(chunk).encode("utf-8")
+            result = "".join(chunks)
+            if result.strip():
+                cache_response(cache_key, result)
+                if vector is not None:
+                    index_response(cache_key, vector)
+            else:
+                yield b"No response received from the agent."
+        except Exception as e:
+            separator = "\n\n" if chunks else ""
+            yield escape(f"{separator}An error occurred: {e}").encode("utf-8")
+    else:
+        yield escape(result).encode("utf-8")
+    yield _SEARCH_TAIL
+
+# Search route: handles form submission and streams the agent response
+@app.post("/search", response_class=HTMLResponse)
+async def search(query: str = Form(...)):
+    return StreamingResponse(stream_search_page(query), media_type=HTML_MEDIA_TYPE)
+
+# Cache statistics, only exposed when CACHE_DEBUG is set
+if settings.cache_debug:
+    @app.get("/debug/cache")
+    async def cache_stats():
+        return {
+            "strip_ansi_codes": _strip_ansi_codes_cached.cache_info()._asdict(),
+            "responses": {"size": len(_response_cache), "maxsize": RESPONSE_CACHE_SIZE},
+            "semantic_index": {"size": len(_semantic_keys), "maxsize": RESPONSE_CACHE_SIZE},
+            "yfinance": {"size": len(_yfinance_cache), "maxsize": _yfinance_cache.maxsize},
+        }
+
+# Production server: WORKERS worker processes (one by default), with uvloop and httptools
+# when they are installed. They are optional (uvloop has no Windows build), so fall back to
+# uvicorn's pure-Python defaults without them.
+def serve() -> None:
     import uvicorn
-    # The string "main:app" tells uvicorn to look for an 'app' object in 'main.py'
-    uvicorn.run("main:app")
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8001,
+        workers=settings.workers,
+        loop="uvloop" if importlib.util.find_spec("uvloop") else "asyncio",
+        http="httptools" if importlib.util.find_spec("httptools") else "h11",
+        log_level="warning",
+    )
+
+# Standard entry point for Uvicorn: `python main.py serve` for production, otherwise a
+# single auto-reloading development server
+if __name__ == "__main__":
+    if sys.argv[1:] == ["serve"]:
+        serve()
+    else:
+        import uvicorn
+        # The string "main:app" tells uvicorn to look for an 'app' object in 'main.py'
+        uvicorn.run("main:app", reload=True)
 
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# main.py lives at the repository root and requires a Google API key at import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GOOGLE_API_KEY", "test-key")
@@ -0,0 +1,165 @@
+import asyncio
+import threading
+
+import numpy as np
+import pytest
+from google.api_core.exceptions import TooManyRequests
+from tenacity import wait_none
+
+import main
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        "What is a REIT and how does an IRA work?",
+        "Summarize the latest FOMC decision",
+        "Is the NASDAQ up TODAY?",
+        "Explain what an LLM is",
+        "meta analysis of uber-rich investors",
+        "apple and oranges",
+        "Is NOW a buy",
+        "A stock split: what is it?",
+        "Is a REIT stock a good investment?",
+        "Which FAANG stock is best?",
+        "Should I buy GOLD shares?",
+        "What is the ticker AI?",
+    ],
+)
+def test_extract_tickers_ignores_ordinary_words(query):
+    assert main.extract_tickers(query) == []
+
+
+@pytest.mark.parametrize(
+    "query, tickers",
+    [
+        ("Should I BUY or SELL TSLA?", ["TSLA"]),
+        ("Analyze companies like Tesla, NVDA, and Apple", ["TSLA", "NVDA", "AAPL"]),
+        ("Is TSLA a buy vs Tesla?", ["TSLA"]),
+        ("Compare ticker PLTR with SNOW stock", ["PLTR", "SNOW"]),
+        ("what about $f and $tsla", ["F", "TSLA"]),
+        ("Berkshire Hathaway and BRK-B", ["BRK-B"]),
+    ],
+)
+def test_extract_tickers_finds_symbols(query, tickers):
+    assert main.extract_tickers(query) == tickers
+
+
+def test_response_cache_key_separates_differently_routed_queries():
+    assert main.response_cache_key("NOW stock")[1] == frozenset({"NOW"})
+    assert main.response_cache_key("now stock")[1] == frozenset()
+    assert main.response_cache_key("NOW stock") != main.response_cache_key("now stock")
+    assert main.response_cache_key("Tesla  price") == main.response_cache_key("Tesla price")
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        "Tesla vs Ford",
+        "Ford vs Tesla",
+        "Compare TSLA and RIVN",
+        "Analyze Tesla and Rivian",
+        "Compare NVDA with SMCI and ARM",
+    ],
+)
+def test_route_tickers_leaves_partly_resolved_queries_to_the_orchestrator(query):
+    assert main.extract_tickers(query)
+    assert main.route_tickers(query) == []
+
+
+@pytest.mark.parametrize(
+    "query, tickers",
+    [
+        ("Analyze companies like Tesla, NVDA, and Apple", ["TSLA", "NVDA", "AAPL"]),
+        ("Should I BUY or SELL TSLA?", ["TSLA"]),
+        ("Compare ticker PLTR with SNOW stock", ["PLTR", "SNOW"]),
+        ("How did Berkshire Hathaway do in March?", ["BRK-B"]),
+        ("What is the Tesla stock price?", ["TSLA"]),
+    ],
+)
+def test_route_tickers_fans_out_fully_resolved_queries(query, tickers):
+    assert main.route_tickers(query) == tickers
+
+
+def test_find_similar_response_skips_expired_rows(monkeypatch):
+    monkeypatch.setattr(main, "_semantic_matrix", None)
+    monkeypatch.setattr(main, "_semantic_keys", [])
+    monkeypatch.setattr(main, "_semantic_next_row", 0)
+    monkeypatch.setattr(main, "_response_cache", {})
+    tickers = frozenset({"TSLA"})
+    closest = np.array([1.0, 0.0], dtype=np.float32)
+    close = np.array([0.96, 0.28], dtype=np.float32)
+    main.index_response(("tesla stock price", tickers), closest)
+    main.index_response(("tsla share price", tickers), close)
+    # Only the less similar prompt still has a cached response
+    main.cache_response(("tsla share price", tickers), "cached answer")
+
+    assert main.find_similar_response(closest, tickers) == "cached answer"
+    assert main.find_similar_response(closest, frozenset({"NVDA"})) is None
+
+
+@pytest.fixture
+def llm_runs(monkeypatch):
+    # A fresh semaphore per event loop, and no real backoff between attempts
+    monkeypatch.setattr(main, "LLM_SEMAPHORE", asyncio.Semaphore(1))
+    monkeypatch.setattr(main, "LLM_RETRY_WAIT", wait_none())
+
+
+def test_cancelled_run_keeps_its_permit_until_the_executor_finishes(llm_runs):
+    started, finish = threading.Event(), threading.Event()
+
+    def blocking_run(prompt):
+        started.set()
+        finish.wait(5)
+        return prompt
+
+    async def scenario():
+        task = asyncio.ensure_future(main.run_agent(blocking_run, "query"))
+        await asyncio.get_running_loop().run_in_executor(None, started.wait, 5)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        # The thread is still running, so its permit is still taken
+        assert main.LLM_SEMAPHORE.locked()
+        finish.set()
+        await asyncio.wait_for(main.LLM_SEMAPHORE.acquire(), 5)
+
+    asyncio.run(scenario())
+
+
+def fake_stream_run(attempts):
+    # Each attempt is (chunk or None, error or None)
+    def stream_pooled_agent(pool, prompt, loop, chunks):
+        chunk, error = attempts.pop(0)
+        try:
+            if chunk:
+                loop.call_soon_threadsafe(chunks.put_nowait, chunk)
+            if error:
+                raise error
+        finally:
+            loop.call_soon_threadsafe(chunks.put_nowait, None)
+    return stream_pooled_agent
+
+
+async def collect(stream, chunks):
+    async for chunk in stream:
+        chunks.append(chunk)
+
+
+def test_stream_agent_retries_failures_before_the_first_chunk(llm_runs, monkeypatch):
+    attempts = [(None, TooManyRequests("rate limited")), ("answer", None)]
+    monkeypatch.setattr(main, "stream_pooled_agent", fake_stream_run(attempts))
+    chunks = []
+    asyncio.run(collect(main.stream_agent(None, "query"), chunks))
+    assert chunks == ["answer"]
+    assert attempts == []
+
+
+def test_stream_agent_does_not_retry_once_output_was_sent(llm_runs, monkeypatch):
+    attempts = [("partial", TooManyRequests("rate limited")), ("answer", None)]
+    monkeypatch.setattr(main, "stream_pooled_agent", fake_stream_run(attempts))
+    chunks = []
+    with pytest.raises(TooManyRequests):
+        asyncio.run(collect(main.stream_agent(None, "query"), chunks))
+    assert chunks == ["partial"]
+    assert len(attempts) == 1